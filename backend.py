@@ -1,13 +1,22 @@
 # --- ECO-GRID SENTINEL: PRODUCTION BACKEND ---
 # Features: Pre-Computed Optimization + Live Satellite Analysis + Hardware + Blockchain
 
-import math
+import os
+import gzip
+import hashlib
+import struct
 import threading
+import itertools
+from collections import deque
 import json
 import time
-import random
-from datetime import datetime
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import numpy as np
+from scipy.spatial import cKDTree
+import orjson
 from flask import Flask, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import serial
 
@@ -16,16 +25,66 @@ try:
     import ee
     import geemap
     # Replace with your actual project ID
-    ee.Initialize(project='agrocast-data-project')
+    # High-volume endpoint: built for many concurrent getInfo() requests
+    ee.Initialize(project='agrocast-data-project',
+                  opt_url='https://earthengine-highvolume.googleapis.com')
+    # Shared server-side kernel handle for the TPI focal mean
+    TPI_KERNEL = ee.Kernel.circle(500, 'meters')
     GEE_ACTIVE = True
     print("✅ GOOGLE EARTH ENGINE: CONNECTED")
 except Exception as e:
     GEE_ACTIVE = False
     print(f"⚠️ GEE ERROR: {e} (Running in Offline Mode)")
 
+# --- ACCELERATION (Optional) ---
+try:
+    from numba import njit
+    NUMBA_ACTIVE = True
+except ImportError:
+    NUMBA_ACTIVE = False
+    print("⚠️ NUMBA NOT INSTALLED (Using NumPy placement)")
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON (jsonify + request.get_json) backed by orjson's native encoder."""
+    OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response (skips a str round-trip)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self.OPTIONS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
+# Responses smaller than this aren't worth the gzip CPU
+GZIP_MIN_BYTES = 1024
+
+@app.after_request
+def gzip_response(response):
+    """Transparent gzip for JSON payloads (node lists compress ~8x)."""
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+    # Body depends on Accept-Encoding whether or not this particular one gets compressed
+    response.vary.add('Accept-Encoding')
+    if 'gzip' not in request.headers.get('Accept-Encoding', '').lower():
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=5))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 # --- 1. THE KNOWLEDGE BASE (Pre-Computed / Offline Fallback) ---
 FOREST_MODELS = {
     "Karura Forest": {
@@ -77,23 +136,146 @@ FOREST_MODELS = {
     }
 }
 
+# --- RISK-VECTOR GEOMETRY (Precomputed once at import) ---
+EARTH_RADIUS_KM = 6371.0
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km. Vectorized; float32 is plenty for km-scale spacing."""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(lon2 - lon1)
+    a = np.sin(dphi / 2)**2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2)**2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(a))
+
+def _precompute_soa():
+    """
+    Flattens each forest's risk vectors into parallel NumPy arrays (structure-of-arrays)
+    so sensor placement runs as whole-array expressions instead of a per-vector loop.
+    Sensor spacing is deterministic, so the step counts are computed here once.
+    """
+    for model in FOREST_MODELS.values():
+        vectors = model.get('risk_vectors', [])
+        starts = np.array([v['start'] for v in vectors], dtype=np.float64).reshape(-1, 2)
+        ends = np.array([v['end'] for v in vectors], dtype=np.float64).reshape(-1, 2)
+        types = np.array([v['type'] for v in vectors], dtype=str)
+
+        # Density: High for Roads (0.3km), Low for Rivers (0.8km)
+        density = np.where(types == "ROAD", 0.3, 0.8)
+        s32, e32 = starts.astype(np.float32), ends.astype(np.float32)
+        dists = haversine_km(s32[:, 0], s32[:, 1], e32[:, 0], e32[:, 1])
+
+        model['_risk_starts'] = starts
+        model['_risk_ends'] = ends
+        model['_risk_types'] = types
+        model['_risk_steps'] = (dists / density).astype(np.int64)
+
+_precompute_soa()
+
+# Shared PCG64 generator for placement jitter (its bit generator is lock-protected,
+# so concurrent deploys can draw from it safely)
+_RNG = np.random.default_rng()
+
+# Shared state. Every handler mutates it, so writes (and status snapshots) go through STATE_LOCK.
+# The deques are bounded: old alerts/logs fall off in O(1) instead of growing forever.
+MAX_ALERTS = 1000
+MAX_SMS_LOGS = 1000
+STATE_LOCK = threading.RLock()
 NODE_DB = []
-ALERTS = []
-SMS_LOGS = []
+NODE_TREE = None # cKDTree over NODE_DB (lat, lon), rebuilt on every deployment
+ALERTS = deque(maxlen=MAX_ALERTS)
+SMS_LOGS = deque(maxlen=MAX_SMS_LOGS)
 BLOCKCHAIN_HEIGHT = 142
+# Bumped on every state change; /api/status uses it as its ETag so idle polls cost a 304
+STATE_REVISION = 0
+_BOOT_ID = os.urandom(4).hex() # keeps ETags from a previous run from matching
+# Monotonic ids (len() stops growing once the deques are full)
+_ALERT_IDS = itertools.count(1)
+_SMS_IDS = itertools.count(1)
+
+# Formatted wall-clock time, re-rendered at most once per second
+_TS_CACHE = (0, "")
+
+def hhmmss():
+    global _TS_CACHE
+    t = int(time.time())
+    cached_t, text = _TS_CACHE
+    if t != cached_t:
+        text = time.strftime("%H:%M:%S", time.localtime(t))
+        _TS_CACHE = (t, text) # single rebind, so concurrent readers never see a torn pair
+    return text
+
+# --- GEE RESULT CACHE (Disk) ---
+# A live scan costs tens of seconds of GEE compute and never changes between clicks
+S2_DATE_RANGE = ('2023-01-01', '2024-01-01')
+# Per-user cache dir (not shared /tmp): cached nodes are served as-is, so only we may write them
+GEE_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'ecogrid_gee'
+)
+GEE_CACHE_TTL_S = 86400 # 1 day
+
+def _gee_cache_path(center_lat, center_lon, radius_km):
+    key = f"{center_lat:.3f}_{center_lon:.3f}_{radius_km}_{S2_DATE_RANGE[0]}_{S2_DATE_RANGE[1]}"
+    return os.path.join(GEE_CACHE_DIR, f"{key}.json")
+
+def _gee_cache_dir_ok():
+    """Creates the cache dir (0700) and refuses to use it unless it's ours and private."""
+    try:
+        os.makedirs(GEE_CACHE_DIR, mode=0o700, exist_ok=True)
+        st = os.stat(GEE_CACHE_DIR)
+        if hasattr(os, 'getuid'):
+            if st.st_uid != os.getuid():
+                print(f"⚠️ GEE Cache Dir {GEE_CACHE_DIR} is owned by another user. Cache disabled.")
+                return False
+            if st.st_mode & 0o077:
+                os.chmod(GEE_CACHE_DIR, 0o700)
+    except OSError as e:
+        print(f"⚠️ GEE Cache Dir Error: {e}")
+        return False
+    return True
+
+def _gee_cache_get(center_lat, center_lon, radius_km):
+    if not _gee_cache_dir_ok():
+        return None
+    path = _gee_cache_path(center_lat, center_lon, radius_km)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or not isinstance(entry.get('nodes'), list):
+        return None
+    saved_at = entry.get('saved_at')
+    if not isinstance(saved_at, (int, float)) or time.time() - saved_at > GEE_CACHE_TTL_S:
+        return None
+    return entry['nodes']
+
+def _gee_cache_set(center_lat, center_lon, radius_km, nodes):
+    if not _gee_cache_dir_ok():
+        return
+    path = _gee_cache_path(center_lat, center_lon, radius_km)
+    tmp_path = None
+    try:
+        # Write-then-rename so concurrent readers never see a half-written file.
+        # mkstemp gives each writer (even two scan threads in this process) its own temp file.
+        fd, tmp_path = tempfile.mkstemp(dir=GEE_CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"saved_at": time.time(), "nodes": nodes}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"⚠️ GEE Cache Write Error: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 # --- 2. THE LIVE SATELLITE ENGINE (Phase 1 Logic) ---
-def run_live_satellite_analysis(center_lat, center_lon, radius_km):
-    """
-    Actually queries Google Earth Engine for TPI and NDVI.
-    Returns a list of nodes based on REAL physics.
-    """
-    if not GEE_ACTIVE:
-        print("❌ GEE Offline. Returning empty list.")
-        return []
+# Per-area ee.Image handles. These are client-side expression graphs, not pixels: reusing
+# them only skips rebuilding the graph in Python. GEE's server-side memoization keys on the
+# serialized graph, which is identical on every rebuild, so it applies with or without this.
+_GEE_IMAGE_CACHE = {}
+_GEE_IMAGE_CACHE_LOCK = threading.Lock() # scans run on pool threads
 
-    print(f"🛰️ SATELLITE SCAN: Analyzing {radius_km}km radius around {center_lat}, {center_lon}...")
-    
+def _build_scan_layers(center_lat, center_lon, radius_km):
+    """Builds the TPI/NDVI class image for an area. Returns (classes, roi)."""
     # A. Define Geometry
     # Create a buffer around the center point
     point = ee.Geometry.Point([center_lon, center_lat])
@@ -103,14 +285,14 @@ def run_live_satellite_analysis(center_lat, center_lon, radius_km):
     dem = ee.Image("USGS/SRTMGL1_003").clip(roi)
     s2 = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED") \
         .filterBounds(roi) \
-        .filterDate('2023-01-01', '2024-01-01') \
+        .filterDate(*S2_DATE_RANGE) \
         .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20)) \
         .median() \
         .clip(roi)
 
     # C. Physics: Topography (Relays)
     elevation = dem.select('elevation')
-    tpi = elevation.subtract(elevation.focal_mean(ee.Kernel.circle(500, 'meters')))
+    tpi = elevation.subtract(elevation.focal_mean(TPI_KERNEL))
     ridges = tpi.gt(15).selfMask() # High Ground > 15m relative height
 
     # D. Physics: Risk/NDVI (Sensors)
@@ -118,44 +300,116 @@ def run_live_satellite_analysis(center_lat, center_lon, radius_km):
     # Risk = Low Vegetation (Roads/Clearing) inside high elevation
     risk_zones = ndvi.lt(0.5).selfMask() 
 
-    # E. Sampling (Convert pixels to GPS points)
+    # E. Both masks fused into one class band (1 = ridge/relay, 2 = risk/sensor) so a
+    # single stratifiedSample + getInfo() round-trip returns relays and sensors together.
+    classes = ee.Image(0) \
+        .where(risk_zones.unmask(0), 2) \
+        .where(ridges.unmask(0), 1) \
+        .selfMask() \
+        .rename('c') \
+        .clip(roi)
+    return classes, roi
+
+def run_live_satellite_analysis(center_lat, center_lon, radius_km):
+    """
+    Actually queries Google Earth Engine for TPI and NDVI.
+    Returns a list of nodes based on REAL physics.
+    """
+    if not GEE_ACTIVE:
+        print("❌ GEE Offline. Returning empty list.")
+        return []
+
+    cached = _gee_cache_get(center_lat, center_lon, radius_km)
+    if cached:
+        print(f"⚡ SATELLITE CACHE HIT: {len(cached)} points for {center_lat}, {center_lon}")
+        return cached
+
+    print(f"🛰️ SATELLITE SCAN: Analyzing {radius_km}km radius around {center_lat}, {center_lon}...")
+
+    # A-E. Reuse the area's image handles if this process already built them.
+    # Keyed on the exact area: the cached roi must match the one the results are stored under.
+    key = (center_lat, center_lon, radius_km)
+    with _GEE_IMAGE_CACHE_LOCK:
+        layers = _GEE_IMAGE_CACHE.get(key)
+        if layers is None:
+            layers = _GEE_IMAGE_CACHE[key] = _build_scan_layers(center_lat, center_lon, radius_km)
+    classes, roi = layers
+
+    # Sampling (Convert pixels to GPS points)
     # We limit points to save cost/browser rendering
-    relay_points = ridges.stratifiedSample(numPoints=5, region=roi, scale=100, geometries=True)
-    sensor_points = risk_zones.stratifiedSample(numPoints=15, region=roi, scale=100, geometries=True)
+    samples = classes.stratifiedSample(
+        numPoints=20, classBand='c', classValues=[1, 2], classPoints=[5, 15],
+        region=roi, scale=100, geometries=True
+    )
 
     # F. Parsing to JSON
     nodes = []
-    
-    # Process Relays
+    results = {"RELAY": [], "SENSOR": []}
     try:
-        relays_info = relay_points.aggregate_array('.geo').getInfo()
-        for i, p in enumerate(relays_info):
-            coords = p['coordinates']
-            nodes.append({
-                "id": f"RELAY_LIVE_{i}", "lat": coords[1], "lon": coords[0],
-                "type": "RELAY", "status": "ONLINE", "battery": "SOLAR",
-                "role": "Topo-Optimized Ridge"
-            })
+        for feature in samples.getInfo()['features']:
+            kind = "RELAY" if feature['properties']['c'] == 1 else "SENSOR"
+            results[kind].append(feature['geometry'])
     except Exception as e:
-        print(f"⚠️ GEE Relay Error: {e}")
+        print(f"⚠️ GEE Sampling Error: {e}")
+
+    # Process Relays
+    for i, p in enumerate(results["RELAY"]):
+        coords = p['coordinates']
+        nodes.append({
+            "id": f"RELAY_LIVE_{i}", "lat": coords[1], "lon": coords[0],
+            "type": "RELAY", "status": "ONLINE", "battery": "SOLAR",
+            "role": "Topo-Optimized Ridge"
+        })
 
     # Process Sensors
-    try:
-        sensors_info = sensor_points.aggregate_array('.geo').getInfo()
-        for i, p in enumerate(sensors_info):
-            coords = p['coordinates']
-            nodes.append({
-                "id": f"SENS_LIVE_{i}", "lat": coords[1], "lon": coords[0],
-                "type": "SENSOR", "status": "SLEEP", "battery": "95%",
-                "role": "NDVI Risk Zone"
-            })
-    except Exception as e:
-        print(f"⚠️ GEE Sensor Error: {e}")
+    for i, p in enumerate(results["SENSOR"]):
+        coords = p['coordinates']
+        nodes.append({
+            "id": f"SENS_LIVE_{i}", "lat": coords[1], "lon": coords[0],
+            "type": "SENSOR", "status": "SLEEP", "battery": "95%",
+            "role": "NDVI Risk Zone"
+        })
 
     print(f"✅ LIVE ANALYSIS COMPLETE: Found {len(nodes)} optimal points.")
+    # Empty results mean GEE failed; don't pin the fallback for a whole day
+    if nodes:
+        _gee_cache_set(center_lat, center_lon, radius_km, nodes)
     return nodes
 
 # --- 3. THE HYBRID DEPLOYMENT LOGIC ---
+# Live scans run on their own small pool so a slow GEE call can't hold a request
+# thread forever; after the timeout the request falls back to Pre-Computed while the
+# scan finishes in the background and warms the disk cache for the next click.
+# At most one scan per forest is in flight (repeat clicks join it), so with one worker
+# per forest nothing ever waits in the executor queue.
+GEE_SCAN_TIMEOUT_S = 45
+_GEE_POOL = ThreadPoolExecutor(max_workers=len(FOREST_MODELS), thread_name_prefix="gee-scan")
+_GEE_SCANS = {} # forest name -> Future of its latest live scan
+_GEE_SCANS_LOCK = threading.Lock()
+
+def _live_scan(forest_name):
+    """Returns the forest's in-flight scan, or starts one if none is pending."""
+    with _GEE_SCANS_LOCK:
+        scan = _GEE_SCANS.get(forest_name)
+        if scan is None or scan.done():
+            scan = _GEE_POOL.submit(calculate_deployment, forest_name, use_live_satellite=True)
+            _GEE_SCANS[forest_name] = scan
+        return scan
+
+# Placement only runs at import (see _PRECOMPUTED) on a few dozen points, so the kernel is
+# compiled serially with on-disk caching; threading/fastmath would only add compile time.
+if NUMBA_ACTIVE:
+    @njit(cache=True)
+    def _place_sensors(starts, ends, steps, offsets, jitter, out):
+        """Writes every sensor's (lat, lon) into `out`; each risk vector fills its own slice."""
+        for v in range(starts.shape[0]):
+            denom = max(steps[v], 1)
+            for i in range(steps[v] + 1):
+                fraction = i / denom
+                k = offsets[v] + i
+                out[k, 0] = starts[v, 0] + (ends[v, 0] - starts[v, 0]) * fraction + jitter[k, 0]
+                out[k, 1] = starts[v, 1] + (ends[v, 1] - starts[v, 1]) * fraction + jitter[k, 1]
+
 def calculate_deployment(forest_name, use_live_satellite=False):
     data = FOREST_MODELS.get(forest_name)
     if not data: return []
@@ -165,40 +419,35 @@ def calculate_deployment(forest_name, use_live_satellite=False):
         return run_live_satellite_analysis(data['center'][0], data['center'][1], data['radius_km'])
 
     # OPTION B: PRE-COMPUTED (The "Fast" Way - Backup)
-    nodes = []
-    
     # 1. Place Sensors along Risk Vectors (Roads/Rivers)
-    sensor_count = 0
-    for vector in data.get('risk_vectors', []):
-        start_lat, start_lon = vector['start']
-        end_lat, end_lon = vector['end']
-        
-        # Calculate distance
-        dist = math.sqrt((end_lat - start_lat)**2 + (end_lon - start_lon)**2) * 111 # approx km
-        
-        # Density: High for Roads (0.3km), Low for Rivers (0.8km)
-        density = 0.3 if vector['type'] == "ROAD" else 0.8
-        steps = int(dist / density)
-        
-        for i in range(steps + 1):
-            fraction = i / steps if steps > 0 else 0
-            
-            # ADD JITTER HERE (Random offset +/- 50 meters)
-            jitter_lat = (random.random() - 0.5) * 0.001 
-            jitter_lon = (random.random() - 0.5) * 0.001
-            
-            lat = start_lat + (end_lat - start_lat) * fraction + jitter_lat
-            lon = start_lon + (end_lon - start_lon) * fraction + jitter_lon
-            
-            nodes.append({
-                "id": f"SENS_{sensor_count}",
-                "lat": lat, "lon": lon,
-                "type": "SENSOR",
-                "status": "ACTIVE",
-                "battery": 100,
-                "role": f"Risk Zone ({vector['type']})"
-            })
-            sensor_count += 1
+    starts, ends, steps = data['_risk_starts'], data['_risk_ends'], data['_risk_steps']
+    counts = steps + 1 # a vector with 0 steps still gets one sensor at its start
+    total = int(counts.sum())
+
+    # Which vector each sensor belongs to
+    vector_idx = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.cumsum(counts) - counts
+
+    # ADD JITTER HERE (Random offset +/- 50 meters), one batched draw for every sensor
+    jitter = _RNG.uniform(-5e-4, 5e-4, size=(total, 2))
+
+    if NUMBA_ACTIVE:
+        coords = np.empty((total, 2))
+        _place_sensors(starts, ends, steps, offsets, jitter, coords)
+    else:
+        position = np.arange(total) - offsets[vector_idx]
+        fractions = position / np.maximum(steps[vector_idx], 1)
+        coords = starts[vector_idx] + (ends - starts)[vector_idx] * fractions[:, None] + jitter
+
+    roles = [f"Risk Zone ({t})" for t in data['_risk_types']]
+    nodes = [{
+        "id": f"SENS_{i}",
+        "lat": lat, "lon": lon,
+        "type": "SENSOR",
+        "status": "ACTIVE",
+        "battery": 100,
+        "role": roles[v]
+    } for i, ((lat, lon), v) in enumerate(zip(coords.tolist(), vector_idx.tolist()))]
 
     # 2. Place Relays on Ridges
     relay_count = 0
@@ -215,15 +464,50 @@ def calculate_deployment(forest_name, use_live_satellite=False):
         
     return nodes
 
+def _max_hop_km(sens, relays):
+    """Longest sensor -> nearest-relay link, via one GEMM (|s|^2 + |r|^2 - 2 s.r) instead of a double loop."""
+    # No links to measure (e.g. a live scan that found no ridges): None, not a perfect 0 km
+    if len(sens) == 0 or len(relays) == 0:
+        return None
+    # Centre on the relays first: the identity cancels badly on raw ~40-degree coordinates
+    origin = relays.mean(axis=0)
+    sens, relays = sens - origin, relays - origin
+    d2 = (sens**2).sum(1)[:, None] + (relays**2).sum(1)[None, :] - 2 * sens @ relays.T
+    dist = np.sqrt(np.maximum(d2, 0)) * 111 # approx km (clamp: rounding can dip below 0)
+    return round(float(dist.min(axis=1).max()), 3)
+
+def _deployment_entry(nodes):
+    """Bundles a node list with its spatial index and the stats the dashboard shows."""
+    # One pass over the dicts: float32 coords + type masks feed the tree, counts and hop matrix
+    coords = np.array([[n['lat'], n['lon']] for n in nodes], dtype=np.float32).reshape(-1, 2)
+    types = np.array([n['type'] for n in nodes], dtype=str)
+    is_sensor, is_relay = types == 'SENSOR', types == 'RELAY'
+    sensors, relays = int(is_sensor.sum()), int(is_relay.sum())
+    return {
+        "nodes": nodes,
+        # Spatial index for tip geolocation: O(log n) nearest-node lookups
+        "tree": cKDTree(coords) if nodes else None,
+        "sensors": sensors, "relays": relays,
+        "cost": (sensors * 35) + (relays * 120),
+        "max_hop_km": _max_hop_km(coords[is_sensor], coords[is_relay])
+    }
+
+# Pre-Computed layouts are fixed per process (jitter is drawn once here), so non-live
+# deploys are a dict lookup. NODE_DB is only ever replaced, never mutated, so aliasing is safe.
+_PRECOMPUTED = {name: _deployment_entry(calculate_deployment(name)) for name in FOREST_MODELS}
+
+# The forest list never changes at runtime, so it is serialized exactly once
+_FORESTS_JSON = orjson.dumps(list(FOREST_MODELS.keys()))
+
 # --- API ENDPOINTS ---
 
 @app.route('/api/forests', methods=['GET'])
 def get_forests():
-    return jsonify(list(FOREST_MODELS.keys()))
+    return app.response_class(_FORESTS_JSON, mimetype='application/json')
 
 @app.route('/api/deploy_forest', methods=['POST'])
 def deploy():
-    global NODE_DB
+    global NODE_DB, NODE_TREE, STATE_REVISION
     req = request.json
     name = req.get('forest_name')
     # Frontend can send {"live_analysis": true} to trigger GEE
@@ -232,76 +516,123 @@ def deploy():
     if name not in FOREST_MODELS: return jsonify({"error": "Unknown"}), 404
     
     # DECISION: Real Satellite vs Pre-Computed
-    NODE_DB = calculate_deployment(name, use_live_satellite=live_mode)
-    
-    # Stats Calculation
-    sensors = sum(1 for n in NODE_DB if n['type'] == 'SENSOR')
-    relays = sum(1 for n in NODE_DB if n['type'] == 'RELAY')
-    
-    # Fallback if GEE returns empty
-    if len(NODE_DB) == 0 and live_mode:
-        print("⚠️ GEE returned 0 nodes. Falling back to Pre-Computed.")
-        NODE_DB = calculate_deployment(name, use_live_satellite=False)
-        sensors = sum(1 for n in NODE_DB if n['type'] == 'SENSOR')
-        relays = sum(1 for n in NODE_DB if n['type'] == 'RELAY')
+    # (computed outside the lock: a live scan can take a while)
+    nodes = []
+    scan_completed = False
+    if live_mode and GEE_ACTIVE:
+        scan = _live_scan(name)
+        try:
+            nodes = scan.result(timeout=GEE_SCAN_TIMEOUT_S)
+            scan_completed = True
+        except FutureTimeout:
+            print(f"⚠️ GEE scan exceeded {GEE_SCAN_TIMEOUT_S}s. Finishing in background.")
+    live_used = len(nodes) > 0
+
+    # Fallback if GEE returns empty (or wasn't requested)
+    if live_used:
+        entry = _deployment_entry(nodes)
+    else:
+        if scan_completed:
+            print("⚠️ GEE returned 0 nodes. Falling back to Pre-Computed.")
+        entry = _PRECOMPUTED[name]
+
+    with STATE_LOCK:
+        NODE_DB = entry['nodes']
+        NODE_TREE = entry['tree']
+        STATE_REVISION += 1
 
     return jsonify({
-        "nodes": NODE_DB,
+        "nodes": entry['nodes'],
         "center": FOREST_MODELS[name]['center'],
         "zoom": FOREST_MODELS[name].get('zoom', 12),
         "active_forest": name,
         "stats": {
-            "sensors": sensors, "relays": relays,
-            "cost": (sensors * 35) + (relays * 120),
-            "source": "SATELLITE_LIVE" if live_mode and GEE_ACTIVE else "PRE_COMPUTED",
+            "sensors": entry['sensors'], "relays": entry['relays'],
+            "cost": entry['cost'],
+            "max_hop_km": entry['max_hop_km'],
+            "source": "SATELLITE_LIVE" if live_used else "PRE_COMPUTED",
             "terrain_factor": FOREST_MODELS[name].get('terrain_factor', 1.0)
         }
     })
 
 @app.route('/api/sms_webhook', methods=['POST'])
 def sms_webhook():
-    global BLOCKCHAIN_HEIGHT, SMS_LOGS, ALERTS
+    global BLOCKCHAIN_HEIGHT, STATE_REVISION
     data = request.json
     sender = data.get('sender', 'Anonymous')
     message = data.get('message', '')
     
     # 1. Log to Blockchain
-    BLOCKCHAIN_HEIGHT += 1
-    tx_hash = f"0x{abs(hash(message + str(time.time()))) % 10**16:016x}"
-    
-    log_entry = {
-        "id": f"SMS_{len(SMS_LOGS)+1}",
-        "sender": sender,
-        "message": message,
-        "time": datetime.now().strftime("%H:%M:%S"),
-        "hash": tx_hash,
-        "status": "VERIFYING"
-    }
-    SMS_LOGS.append(log_entry)
-    
-    # 2. Trigger Alert (Simulated Zone)
-    # In a real app, we'd geocode here. For demo, we just alert.
-    ALERTS.insert(0, {
-        "id": len(ALERTS) + 1,
-        "node": "COMMUNITY_TIP",
-        "threat": f"SMS TIP: {message}",
-        "time": datetime.now().strftime("%H:%M:%S"),
-        "status": "VERIFYING",
-        "tx_hash": tx_hash,
-        "gps": "N/A"
-    })
+    # 64-bit digest over message + timestamp + salt (two tips in the same tick still differ)
+    digest = hashlib.blake2b(message.encode() + struct.pack('<d', time.time()) + os.urandom(4), digest_size=8)
+    tx_hash = f"0x{digest.hexdigest()}"
+
+    # Coordinates are optional: no GPS fix (null), junk or NaN just leaves the tip un-geolocated
+    tip_pos = None
+    try:
+        lat, lon = float(data['lat']), float(data['lon'])
+        if np.isfinite(lat) and np.isfinite(lon):
+            tip_pos = (lat, lon)
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    now = hhmmss()
+    with STATE_LOCK:
+        # Geolocate the tip if the gateway sent coordinates: attach it to the nearest nodes
+        node, gps, nearby = "COMMUNITY_TIP", "N/A", []
+        if NODE_TREE is not None and tip_pos is not None:
+            lat, lon = tip_pos
+            _, idx = NODE_TREE.query([lat, lon], k=min(3, len(NODE_DB)))
+            nearby = [NODE_DB[i]['id'] for i in np.atleast_1d(idx)]
+            node, gps = nearby[0], f"{lat:.5f}, {lon:.5f}"
+
+        BLOCKCHAIN_HEIGHT += 1
+        STATE_REVISION += 1
+        log_entry = {
+            "id": f"SMS_{next(_SMS_IDS)}",
+            "sender": sender,
+            "message": message,
+            "time": now,
+            "hash": tx_hash,
+            "status": "VERIFYING"
+        }
+        SMS_LOGS.append(log_entry)
+
+        # 2. Trigger Alert (nearest node if geolocated, otherwise a generic community tip)
+        ALERTS.appendleft({
+            "id": next(_ALERT_IDS),
+            "node": node,
+            "threat": f"SMS TIP: {message}",
+            "time": now,
+            "status": "VERIFYING",
+            "tx_hash": tx_hash,
+            "gps": gps,
+            "nearby_nodes": nearby
+        })
 
     return jsonify({"status": "Logged", "tx_hash": tx_hash})
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    return jsonify({
-        "system_status": "ONLINE",
-        "nodes": NODE_DB, 
-        "alerts": ALERTS, 
-        "sms_logs": SMS_LOGS,
-        "blockchain": {"height": BLOCKCHAIN_HEIGHT}
-    })
+    with STATE_LOCK:
+        # Weak ETag: the gzip and identity bodies are the same state in different codings
+        etag = f"{_BOOT_ID}-{STATE_REVISION}"
+        # Nothing changed since the client's last poll: skip serialization entirely
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag, weak=True)
+            response.vary.add('Accept-Encoding')
+            return response
+        payload = {
+            "system_status": "ONLINE",
+            "nodes": NODE_DB,
+            "alerts": list(ALERTS),
+            "sms_logs": list(SMS_LOGS),
+            "blockchain": {"height": BLOCKCHAIN_HEIGHT}
+        }
+    response = jsonify(payload)
+    response.set_etag(etag, weak=True)
+    return response
 
 if __name__ == '__main__':
     print("🚀 BACKEND ONLINE")